@@ -15,44 +15,83 @@
 
 """Tests for dm_control.suite domains."""
 
+import functools
+import os
+from unittest import mock
+
 from absl.testing import absltest
 from absl.testing import parameterized
 from dm_control import suite
 from dm_control.mujoco.wrapper.mjbindings import constants
 from dm_control.rl import control
-import mock
 import numpy as np
 
 
+# Environments for read-only tests are cached per process (see `_load_cached`),
+# and tests that reset or step an environment load their own. The parameterized
+# cases are therefore independent and can be sharded across processes, e.g.
+# with `pytest -n auto dm_control/suite/suite_test.py`.
 _DOMAINS_AND_TASKS = [
     dict(domain=domain, task=task) for domain, task in suite.ALL_TASKS
 ]
 
+# If DM_PREWARM is set (to anything other than '0' or 'false'), all the cached
+# environments are loaded once before any test runs. This only helps
+# single-process runs: each pytest-xdist worker only runs its own shard, so
+# prewarming is skipped there rather than compiling every model per worker.
+_PREWARM = (
+    os.environ.get('DM_PREWARM', '').lower() not in ('', '0', 'false')
+    and 'PYTEST_XDIST_WORKER' not in os.environ)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_cached(domain, task):
+  """Returns an environment shared within this process by read-only tests.
+
+  Callers must only inspect the environment's model and specs. Tests that
+  reset, step or otherwise modify an environment should call `suite.load`.
+  """
+  return suite.load(domain, task)
+
 
 def uniform_random_policy(action_spec, random=None):
-  lower_bounds = action_spec.minimum
-  upper_bounds = action_spec.maximum
+  lower_bounds = np.array(action_spec.minimum, dtype=np.float64)
+  upper_bounds = np.array(action_spec.maximum, dtype=np.float64)
   # Draw values between -1 and 1 for actions where the min/max is set to
-  # MuJoCo's internal limit.
-  lower_bounds = np.where(
-      np.abs(lower_bounds) >= constants.mjMAXVAL, -1.0, lower_bounds)
-  upper_bounds = np.where(
-      np.abs(upper_bounds) >= constants.mjMAXVAL, 1.0, upper_bounds)
-  random_state = np.random.RandomState(random)
-  def policy(time_step):
+  # MuJoCo's internal limit. The bounds above are copies, so overwrite them in
+  # place.
+  lower_bounds[np.abs(lower_bounds) >= constants.mjMAXVAL] = -1.0
+  upper_bounds[np.abs(upper_bounds) >= constants.mjMAXVAL] = 1.0
+  span = upper_bounds - lower_bounds
+  shape = lower_bounds.shape
+  dtype = action_spec.dtype
+  rng = np.random.default_rng(random)
+  def policy(time_step, out=None):
     del time_step  # Unused.
-    return random_state.uniform(lower_bounds, upper_bounds)
+    if out is None:
+      out = np.empty(shape, dtype)
+    # Sample in-place to avoid allocating temporaries. `out` may have leading
+    # batch dimensions, in which case one action is drawn per leading index.
+    rng.random(out=out, dtype=out.dtype)
+    np.multiply(out, span, out=out)
+    np.add(out, lower_bounds, out=out)
+    return out
   return policy
 
 
 def step_environment(env, policy, num_episodes=5, max_steps_per_episode=10):
+  action_spec = env.action_spec()
   for _ in range(num_episodes):
     step_count = 0
+    actions = np.empty((max_steps_per_episode,) + action_spec.shape,
+                       action_spec.dtype)
     time_step = env.reset()
     yield time_step
+    # The random policies used here ignore `time_step`, so all the actions for
+    # an episode can be drawn in a single batch up front.
+    policy(time_step, out=actions)
     while not time_step.last():
-      action = policy(time_step)
-      time_step = env.step(action)
+      time_step = env.step(actions[step_count])
       step_count += 1
       yield time_step
       if step_count >= max_steps_per_episode:
@@ -65,81 +104,126 @@ def make_trajectory(domain, task, seed, **trajectory_kwargs):
   return step_environment(env, policy, **trajectory_kwargs)
 
 
+def stack_trajectory(trajectory):
+  """Stacks each field of the time steps in `trajectory` into an array.
+
+  Args:
+    trajectory: An iterable of `TimeStep`s.
+
+  Returns:
+    A dict mapping 'step_type', 'reward' and 'discount' to 1D arrays, and each
+    observation name to an array whose leading dimension indexes time. Rewards
+    and discounts of first time steps are stored as NaN.
+  """
+  time_steps = list(trajectory)
+  stacked = {
+      'step_type': np.array([t.step_type for t in time_steps]),
+      'reward': np.array([t.reward for t in time_steps], dtype=float),
+      'discount': np.array([t.discount for t in time_steps], dtype=float),
+  }
+  for name in time_steps[0].observation:
+    stacked['observation/' + name] = np.stack(
+        [t.observation[name] for t in time_steps])
+  return stacked
+
+
 class SuiteTest(parameterized.TestCase):
   """Tests run on all the tasks registered."""
 
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    if _PREWARM:
+      for domain, task in suite.ALL_TASKS:
+        _load_cached(domain, task)
+
   def test_constants(self):
     num_tasks = sum(len(tasks) for tasks in suite.TASKS_BY_DOMAIN.values())
     self.assertLen(suite.ALL_TASKS, num_tasks)
 
-  def _validate_observation(self, observation_dict, observation_spec):
-    obs = observation_dict.copy()
-    for name, spec in observation_spec.items():
-      arr = obs.pop(name)
-      self.assertEqual(arr.shape, spec.shape)
-      self.assertEqual(arr.dtype, spec.dtype)
+  def _validate_observation(self, observation_dict, observation_specs):
+    for name, shape, dtype in observation_specs:
+      arr = observation_dict[name]
+      self.assertEqual(
+          (arr.shape, arr.dtype), (shape, dtype),
+          msg='{!r} does not match its spec.'.format(name))
       self.assertTrue(
-          np.all(np.isfinite(arr)),
+          np.isfinite(arr).all(),
           msg='{!r} has non-finite value(s): {!r}'.format(name, arr))
-    self.assertEmpty(
-        obs,
-        msg='Observation contains arrays(s) that are not in the spec: {!r}'
-        .format(obs))
-
-  def _validate_reward_range(self, time_step):
-    if time_step.first():
-      self.assertIsNone(time_step.reward)
-    else:
-      self.assertIsInstance(time_step.reward, float)
-      self.assertBetween(time_step.reward, 0, 1)
-
-  def _validate_discount(self, time_step):
-    if time_step.first():
-      self.assertIsNone(time_step.discount)
-    else:
-      self.assertIsInstance(time_step.discount, float)
-      self.assertBetween(time_step.discount, 0, 1)
+    # Every name in the spec is present, so any extra arrays show up as a
+    # difference in length. Only build the set difference when reporting.
+    if len(observation_dict) != len(observation_specs):
+      extra_names = observation_dict.keys() - {
+          name for name, _, _ in observation_specs}
+      self.fail('Observation contains arrays(s) that are not in the spec: {!r}'
+                .format(sorted(extra_names)))
+
+  def _validate_unit_interval(self, name, values, is_float, is_first):
+    """Checks the per-step `values` of `name` collected over whole episodes.
+
+    Args:
+      name: Name of the time step field, used in failure messages.
+      values: Float array of the field's value at each step, with None stored
+        as NaN.
+      is_float: Bool array marking the steps whose value was a float.
+      is_first: Bool array marking the first step of each episode.
+    """
+    self.assertTrue(
+        np.all(np.isnan(values[is_first]) & ~is_float[is_first]),
+        msg='First {!r} must be None: {!r}'.format(name, values[is_first]))
+    subsequent = values[~is_first]
+    self.assertTrue(
+        np.all(is_float[~is_first]),
+        msg='{!r} must be float: {!r}'.format(name, subsequent))
+    self.assertTrue(
+        np.all((subsequent >= 0.0) & (subsequent <= 1.0)),
+        msg='{!r} must lie in [0, 1]: {!r}'.format(name, subsequent))
 
   def _validate_control_range(self, lower_bounds, upper_bounds):
-    for b in lower_bounds:
-      self.assertEqual(b, -1.0)
-    for b in upper_bounds:
-      self.assertEqual(b, 1.0)
+    self.assertTrue(
+        np.all(lower_bounds == -1.0),
+        msg='Lower bounds are not all -1: {!r}'.format(lower_bounds))
+    self.assertTrue(
+        np.all(upper_bounds == 1.0),
+        msg='Upper bounds are not all 1: {!r}'.format(upper_bounds))
 
   @parameterized.parameters(_DOMAINS_AND_TASKS)
   def test_components_have_names(self, domain, task):
-    env = suite.load(domain, task)
+    env = _load_cached(domain, task)
     model = env.physics.model
 
-    object_types_and_size_fields = [
-        ('body', 'nbody'),
-        ('joint', 'njnt'),
-        ('geom', 'ngeom'),
-        ('site', 'nsite'),
-        ('camera', 'ncam'),
-        ('light', 'nlight'),
-        ('mesh', 'nmesh'),
-        ('hfield', 'nhfield'),
-        ('texture', 'ntex'),
-        ('material', 'nmat'),
-        ('equality', 'neq'),
-        ('tendon', 'ntendon'),
-        ('actuator', 'nu'),
-        ('sensor', 'nsensor'),
-        ('numeric', 'nnumeric'),
-        ('text', 'ntext'),
-        ('tuple', 'ntuple'),
+    # Scan MuJoCo's null-separated name buffer directly: an object is unnamed
+    # iff its name address points at a null byte. This checks all objects of a
+    # given type at once instead of calling `id2name` for every ID.
+    names = np.frombuffer(model.names, dtype=np.uint8)
+    object_types_and_name_address_fields = [
+        ('body', 'name_bodyadr'),
+        ('joint', 'name_jntadr'),
+        ('geom', 'name_geomadr'),
+        ('site', 'name_siteadr'),
+        ('camera', 'name_camadr'),
+        ('light', 'name_lightadr'),
+        ('mesh', 'name_meshadr'),
+        ('hfield', 'name_hfieldadr'),
+        ('texture', 'name_texadr'),
+        ('material', 'name_matadr'),
+        ('equality', 'name_eqadr'),
+        ('tendon', 'name_tendonadr'),
+        ('actuator', 'name_actuatoradr'),
+        ('sensor', 'name_sensoradr'),
+        ('numeric', 'name_numericadr'),
+        ('text', 'name_textadr'),
+        ('tuple', 'name_tupleadr'),
     ]
-    for object_type, size_field in object_types_and_size_fields:
-      for idx in range(getattr(model, size_field)):
-        object_name = model.id2name(idx, object_type)
-        self.assertNotEqual(object_name, '',
-                            msg='Model {!r} contains unnamed {!r} with ID {}.'
-                            .format(model.name, object_type, idx))
+    for object_type, address_field in object_types_and_name_address_fields:
+      unnamed_ids = np.flatnonzero(names[getattr(model, address_field)] == 0)
+      self.assertEmpty(unnamed_ids,
+                       msg='Model {!r} contains unnamed {!r} with ID(s) {}.'
+                       .format(model.name, object_type, unnamed_ids.tolist()))
 
   @parameterized.parameters(_DOMAINS_AND_TASKS)
   def test_model_has_at_least_2_cameras(self, domain, task):
-    env = suite.load(domain, task)
+    env = _load_cached(domain, task)
     model = env.physics.model
     self.assertGreaterEqual(model.ncam, 2,
                             'Model {!r} should have at least 2 cameras, has {}.'
@@ -150,8 +234,10 @@ class SuiteTest(parameterized.TestCase):
     """Tests that the environment timesteps conform to specifications."""
     is_benchmark = (domain, task) in suite.BENCHMARKING
     env = suite.load(domain, task)
-    observation_spec = env.observation_spec()
     action_spec = env.action_spec()
+    # Flatten the observation spec once rather than walking it on every step.
+    observation_specs = tuple((name, spec.shape, spec.dtype)
+                              for name, spec in env.observation_spec().items())
 
     # Check action bounds.
     if is_benchmark:
@@ -159,30 +245,55 @@ class SuiteTest(parameterized.TestCase):
 
     # Step through the environment, applying random actions sampled within the
     # valid range and check the observations, rewards, and discounts.
+    # Rewards and discounts are recorded into preallocated arrays and checked
+    # once after stepping.
+    num_episodes = 5
+    max_steps_per_episode = 10
+    max_time_steps = num_episodes * (max_steps_per_episode + 1)
+    rewards = np.empty(max_time_steps)
+    discounts = np.empty(max_time_steps)
+    reward_is_float = np.empty(max_time_steps, dtype=bool)
+    discount_is_float = np.empty(max_time_steps, dtype=bool)
+    is_first = np.empty(max_time_steps, dtype=bool)
+    num_time_steps = 0
     policy = uniform_random_policy(action_spec)
-    for time_step in step_environment(env, policy):
-      self._validate_observation(time_step.observation, observation_spec)
-      self._validate_discount(time_step)
-      if is_benchmark:
-        self._validate_reward_range(time_step)
+    for time_step in step_environment(env, policy, num_episodes,
+                                      max_steps_per_episode):
+      self._validate_observation(time_step.observation, observation_specs)
+      # None is stored as NaN.
+      rewards[num_time_steps] = time_step.reward
+      discounts[num_time_steps] = time_step.discount
+      reward_is_float[num_time_steps] = isinstance(time_step.reward, float)
+      discount_is_float[num_time_steps] = isinstance(time_step.discount, float)
+      is_first[num_time_steps] = time_step.first()
+      num_time_steps += 1
+    is_first = is_first[:num_time_steps]
+    self._validate_unit_interval('discount', discounts[:num_time_steps],
+                                 discount_is_float[:num_time_steps], is_first)
+    if is_benchmark:
+      self._validate_unit_interval('reward', rewards[:num_time_steps],
+                                   reward_is_float[:num_time_steps], is_first)
 
   @parameterized.parameters(_DOMAINS_AND_TASKS)
   def test_environment_is_deterministic(self, domain, task):
     """Tests that identical seeds and actions produce identical trajectories."""
     seed = 0
-    # Iterate over two trajectories generated using identical sequences of
-    # random actions, and with identical task random states. Check that the
-    # observations, rewards, discounts and step types are identical.
-    trajectory1 = make_trajectory(domain=domain, task=task, seed=seed)
-    trajectory2 = make_trajectory(domain=domain, task=task, seed=seed)
-    for time_step1, time_step2 in zip(trajectory1, trajectory2):
-      self.assertEqual(time_step1.step_type, time_step2.step_type)
-      self.assertEqual(time_step1.reward, time_step2.reward)
-      self.assertEqual(time_step1.discount, time_step2.discount)
-      for key in time_step1.observation.keys():
-        np.testing.assert_array_equal(
-            time_step1.observation[key], time_step2.observation[key],
-            err_msg='Observation {!r} is not equal.'.format(key))
+    # Generate two trajectories using identical sequences of random actions,
+    # and with identical task random states. Check that the observations,
+    # rewards, discounts and step types are identical, comparing each field
+    # over the whole trajectory at once.
+    trajectory1 = stack_trajectory(
+        make_trajectory(domain=domain, task=task, seed=seed))
+    trajectory2 = stack_trajectory(
+        make_trajectory(domain=domain, task=task, seed=seed))
+    self.assertEqual(list(trajectory1), list(trajectory2))
+    unequal_fields = [
+        name for name in trajectory1
+        if not np.array_equal(trajectory1[name], trajectory2[name],
+                              equal_nan=True)]
+    self.assertEmpty(
+        unequal_fields,
+        msg='Trajectory field(s) {!r} are not equal.'.format(unequal_fields))
 
   def assertCorrectColors(self, physics, reward):
     colors = physics.named.model.mat_rgba
@@ -248,7 +359,7 @@ class SuiteTest(parameterized.TestCase):
 
   @parameterized.parameters(_DOMAINS_AND_TASKS)
   def test_observations_dont_contain_constant_elements(self, domain, task):
-    env = suite.load(domain, task)
+    env = _load_cached(domain, task)
     trajectory = make_trajectory(domain=domain, task=task, seed=0,
                                  num_episodes=2, max_steps_per_episode=1000)
     observations = {name: [] for name in env.observation_spec()}
@@ -218,6 +218,8 @@ notebook: [Open In Google Colab](https://colab.research.google.com/github/google
         'mock',
         'nose',
         'pillow>=10.2.0',
+        'pytest',
+        'pytest-xdist',
     ],
     test_suite='nose.collector',
     packages=find_packages(),
@@ -24,10 +24,6 @@ print(physics)
 pixels = physics.render()
 print(pixels)
 
-from PIL import Image
-Image.fromarray(pixels)
-print(Image)
-
 # Reset the simulation, move the slide joint upwards and recompute derived
 # quantities (e.g. the positions of the body and geoms).
 with physics.reset_context():
@@ -41,8 +37,10 @@ print(physics.named.data.geom_xpos)
 # 1    box [ 0         0         0.8     ]
 # 2 sphere [ 0.2       0.2       1       ]
 
-# Advance the simulation for 1 second.
-while physics.time() < 1.:
+# Advance the simulation for 1 second, using a fixed number of steps rather
+# than reading back the simulation time after every step.
+n_steps = int(round(1. / physics.model.opt.timestep))
+for _ in range(n_steps):
   physics.step()
 
 # Print the new z-positions of the 'box' and 'sphere' geoms.
@@ -1,5 +1,6 @@
 from dm_control import suite
 import numpy as np
+import sys
 import time
 
 # this is an RL equivalent example of how to set up RL with dm_control
@@ -8,19 +9,41 @@ import time
 # load one task:
 env = suite.load(domain_name = "cartpole", task_name = "swingup")
 
+# set to True to trace reward, discount and observation at every step
+DEBUG = False
+
+# random actions are drawn from a single Generator shared by all tasks, in
+# batches of BATCH_SIZE steps per call (suite episodes last 1000 steps)
+rng = np.random.default_rng()
+BATCH_SIZE = 1000
+
 # iterate over a task set:
 for domain_name, task_name in suite.BENCHMARKING:
     env = suite.load(domain_name, task_name)
     print("domain name = ", domain_name, " task_name = ", task_name)
-    time.sleep(2)
 
-    # step through an episode and print out reward, discount and observation
+    # step through an episode with uniformly random actions. The action range
+    # and sample buffer are set up once per task instead of once per step.
     action_spec = env.action_spec()
+    low = action_spec.minimum
+    span = action_spec.maximum - low
+    actions = np.empty((BATCH_SIZE,) + action_spec.shape)
     time_step = env.reset()
+    sum_reward = 0.0
+    num_steps = 0
+    start = time.time()
 
     while not time_step.last():
-        action = np.random.uniform(action_spec.minimum, action_spec.maximum, size=action_spec.shape)
-        time_step = env.step(action)
-        print(time_step.reward, time_step.discount, time_step.observation)
-        #time.sleep(1)
+        if num_steps % BATCH_SIZE == 0:
+            rng.random(out=actions)
+            actions *= span
+            actions += low
+        time_step = env.step(actions[num_steps % BATCH_SIZE])
+        sum_reward += time_step.reward
+        num_steps += 1
+        if DEBUG:
+            sys.stdout.write(f"{time_step.reward} {time_step.discount} {time_step.observation}\n")
 
+    elapsed = time.time() - start
+    print("steps = ", num_steps, " sum_reward = ", sum_reward,
+          " steps/sec = ", num_steps / elapsed)